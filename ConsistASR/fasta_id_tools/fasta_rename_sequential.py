@@ -1,32 +1,109 @@
 #!/usr/bin/env python3
 import argparse
+import mmap
 import sys
-from textwrap import wrap
+
+# Bytes that str.split() treats as ASCII whitespace
+WHITESPACE = b' \t\n\r\x0b\x0c'
+
+def join_seq_lines(body):
+    # Each sequence line is stripped and the lines are joined, so whitespace
+    # inside a line is kept as is. When line breaks are the only whitespace
+    # (the usual case) this is a single C-level translate; '\r' counts as a
+    # line break, as in text-mode reading.
+    seq = body.translate(None, WHITESPACE)
+    if len(seq) + body.count(b'\n') + body.count(b'\r') == len(body):
+        return seq
+    lines = body.replace(b'\r\n', b'\n').replace(b'\r', b'\n').split(b'\n')
+    return b''.join([line.strip() for line in lines])
 
 def read_fasta(path):
-    header = None
-    seq_chunks = []
-    with open(path) as f:
-        for line in f:
-            line = line.rstrip('\n')
-            if not line:
-                continue
-            if line.startswith('>'):
-                if header is not None:
-                    yield header, ''.join(seq_chunks)
-                header = line[1:].strip()
-                seq_chunks = []
-            else:
-                seq_chunks.append(line.strip())
-    if header is not None:
-        yield header, ''.join(seq_chunks)
+    # Sequences are yielded as bytes: only the header is decoded, since the
+    # body is copied through to the output unchanged apart from rewrapping
+    with open(path, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and pipes cannot be mapped
+            buf = f.read()
+        try:
+            # Records are split on "\n>" by the C-level find; anything
+            # before the first header is ignored.
+            start = 0 if buf[:1] == b'>' else buf.find(b'\n>') + 1
+            if buf[start:start + 1] != b'>':
+                return
+            size = len(buf)
+            while start < size:
+                end = buf.find(b'\n>', start)
+                if end < 0:
+                    end = size
+                header, _, body = buf[start + 1:end].partition(b'\n')
+                yield header.decode().strip(), join_seq_lines(body)
+                start = end + 1
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+def count_fasta(path):
+    # Same record boundaries as read_fasta ('>' at the start of the file or
+    # of a line), counted with bytes.count over 1 MiB blocks without parsing
+    n = 0
+    prev = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            n += block.count(b'\n>') + (prev + block[:1] == b'\n>')
+            prev = block[-1:]
+    return n
+
+def write_fasta(records, out_path, width=60, flush_every=1000):
+    # Sequences arrive as bytes from read_fasta and only the new header is
+    # encoded. Records are appended to one bytearray that is written out every
+    # `flush_every` records, so the file sees a few large writes instead
+    # of one per line. Slicing avoids textwrap's list of chunks (and its
+    # habit of breaking lines at '-' gap characters). width=0 writes each
+    # sequence on a single line.
+    buf = bytearray()
+    n = 0
+    with open(out_path, 'wb') as out:
+        for n, (h, s) in enumerate(records, start=1):
+            buf += f">{h}\n".encode()
+            if width:
+                for i in range(0, len(s), width):
+                    buf += s[i:i + width]
+                    buf += b"\n"
+            elif s:
+                buf += s
+                buf += b"\n"
+            if n % flush_every == 0:
+                out.write(buf)
+                buf.clear()
+        out.write(buf)
+    return n
+
+def rename_records(records, map_out, width):
+    """
+    Yield (seqNN, seq) for each (old_header, seq), writing the
+    new_id<TAB>old_header mapping line to map_out as it goes.
+    """
+    used_ids = set()
+
+    for i, (old_header, seq) in enumerate(records, start=1):
+        base_id = f"seq{str(i).zfill(width)}"
+        new_id = base_id
+        suffix = 1
+        while new_id in used_ids:
+            new_id = f"{base_id}_{suffix}"
+            suffix += 1
+        used_ids.add(new_id)
 
-def write_fasta(records, out_path):
-    with open(out_path, 'w') as out:
-        for h, s in records:
-            out.write(f">{h}\n")
-            for chunk in wrap(s, 60):
-                out.write(chunk + "\n")
+        map_out.write(f"{new_id}\t{old_header}\n")
+        yield new_id, seq
+
+def non_negative_int(value):
+    ivalue = int(value)
+    if ivalue < 0:
+        raise argparse.ArgumentTypeError("Value must be a non-negative integer.")
+    return ivalue
 
 def main():
     ap = argparse.ArgumentParser(
@@ -35,39 +112,30 @@ def main():
     ap.add_argument("--in", dest="in_fasta", required=True, help="Input FASTA")
     ap.add_argument("--out", dest="out_fasta", required=True, help="Output FASTA with new IDs")
     ap.add_argument("--map", dest="map_tsv", required=True, help="Output mapping TSV (new_id<TAB>old_header)")
+    ap.add_argument(
+        "--wrap",
+        type=non_negative_int,
+        default=60,
+        help="Line width for output FASTA sequences (0 = one line per sequence). Default: 60",
+    )
     args = ap.parse_args()
 
-    records = list(read_fasta(args.in_fasta))
-    n = len(records)
+    # Count records up front (needed for the ID width) so the records
+    # themselves can be streamed rather than held in a list
+    n = count_fasta(args.in_fasta)
     if n == 0:
         sys.exit("[ERROR] No sequences found in input FASTA.")
 
     # Digit Determination (Example: 1–99 -> 2 digits, 100–999 -> 3 digits)
     width = max(2, len(str(n)))
 
-    new_records = []
-    mapping_lines = []
-    used_ids = set()
-
-    for i, (old_header, seq) in enumerate(records, start=1):
-        base_id = f"seq{str(i).zfill(width)}"
-        new_id = base_id
-        suffix = 1
-        while new_id in used_ids:
-            new_id = f"{base_id}_{suffix}"
-            suffix += 1
-        used_ids.add(new_id)
-
-        new_records.append((new_id, seq))
-        mapping_lines.append(f"{new_id}\t{old_header}")
-
-    write_fasta(new_records, args.out_fasta)
+    # Renamed records stream straight into both outputs
     with open(args.map_tsv, "w") as m:
         m.write("new_id\told_header\n")
-        for line in mapping_lines:
-            m.write(line + "\n")
+        records = read_fasta(args.in_fasta)
+        n_written = write_fasta(rename_records(records, m, width), args.out_fasta, width=args.wrap)
 
-    print(f"[INFO] Wrote {len(new_records)} sequences to {args.out_fasta}")
+    print(f"[INFO] Wrote {n_written} sequences to {args.out_fasta}")
     print(f"[INFO] Wrote mapping table to {args.map_tsv}")
 
 if __name__ == "__main__":
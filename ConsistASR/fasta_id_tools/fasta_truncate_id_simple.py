@@ -1,84 +1,140 @@
 #!/usr/bin/env python3
 import argparse
+import mmap
 import sys
 import re
-from textwrap import wrap
+from collections import defaultdict
+from itertools import chain
 
-VALID_RE = re.compile(r'^([A-Za-z0-9_]+)')
+# Leading run of ID characters; .match() anchors it at the start
+VALID_RE = re.compile(r'[A-Za-z0-9_]+')
 
-def read_fasta(path):
-    header = None
-    seq_chunks = []
-    with open(path) as f:
-        for line in f:
-            line = line.rstrip('\n')
-            if not line:
-                continue
-            if line.startswith('>'):
-                if header is not None:
-                    yield header, ''.join(seq_chunks)
-                header = line[1:].strip()
-                seq_chunks = []
-            else:
-                seq_chunks.append(line.strip())
-    if header is not None:
-        yield header, ''.join(seq_chunks)
-
-def write_fasta(records, out_path):
-    with open(out_path, 'w') as out:
-        for h, s in records:
-            out.write(f">{h}\n")
-            for chunk in wrap(s, 60):
-                out.write(chunk + "\n")
+def join_seq_lines(body):
+    # Each sequence line is stripped and the lines are joined, so whitespace
+    # inside a line is kept as is. When line breaks are the only whitespace
+    # (the usual case) this is a single split/join; '\r' counts as a line
+    # break, as in text-mode reading.
+    seq = ''.join(body.split())
+    if len(seq) + body.count('\n') + body.count('\r') == len(body):
+        return seq
+    lines = body.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return ''.join([line.strip() for line in lines])
 
-def main():
-    ap = argparse.ArgumentParser(
-        description="Truncate FASTA IDs at the first non-alnum/underscore character and output mapping."
-    )
-    ap.add_argument("--in", dest="in_fasta", required=True, help="Input FASTA")
-    ap.add_argument("--out", dest="out_fasta", required=True, help="Output FASTA with truncated IDs")
-    ap.add_argument("--map", dest="map_tsv", required=True, help="Output mapping TSV (new_id<TAB>old_header)")
-    args = ap.parse_args()
+def read_fasta(path):
+    with open(path, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and pipes cannot be mapped
+            buf = f.read()
+        try:
+            # Records are split on "\n>" by the C-level find; anything
+            # before the first header is ignored.
+            start = 0 if buf[:1] == b'>' else buf.find(b'\n>') + 1
+            if buf[start:start + 1] != b'>':
+                return
+            size = len(buf)
+            while start < size:
+                end = buf.find(b'\n>', start)
+                if end < 0:
+                    end = size
+                header, _, body = buf[start + 1:end].decode().partition('\n')
+                yield header.strip(), join_seq_lines(body)
+                start = end + 1
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
 
-    records = list(read_fasta(args.in_fasta))
-    if not records:
-        sys.exit("[ERROR] No sequences found in input FASTA.")
+def write_fasta(records, out_path, width=60, flush_every=1000):
+    # Records are encoded into one bytearray that is written out every
+    # `flush_every` records, so the file sees a few large writes instead
+    # of one per line. Slicing avoids textwrap's list of chunks (and its
+    # habit of breaking lines at '-' gap characters). width=0 writes each
+    # sequence on a single line.
+    buf = bytearray()
+    n = 0
+    with open(out_path, 'wb') as out:
+        for n, (h, s) in enumerate(records, start=1):
+            parts = [f">{h}\n"]
+            if width:
+                parts.extend(s[i:i + width] + "\n" for i in range(0, len(s), width))
+            elif s:
+                parts.append(s + "\n")
+            buf += "".join(parts).encode()
+            if n % flush_every == 0:
+                out.write(buf)
+                buf.clear()
+        out.write(buf)
+    return n
 
-    new_records = []
-    mapping_lines = []
+def rename_records(records, map_out):
+    """
+    Yield (new_id, seq) for each (old_header, seq), writing the
+    new_id<TAB>old_header mapping line to map_out as it goes.
+    """
     used_ids = set()
+    next_suffix = defaultdict(int)  # base -> next _N suffix to try
     auto_id_counter = 1
+    match_base = VALID_RE.match
 
     for old_header, seq in records:
-        m = VALID_RE.match(old_header)
+        m = match_base(old_header)
         if m:
-            base = m.group(1)
+            base = m.group()
         else:
             # Fallback for abnormal cases where the start does not begin with alphanumeric characters or an underscore
             base = f"id{auto_id_counter}"
             auto_id_counter += 1
             print(f"[WARN] Header '{old_header}' has no leading [A-Za-z0-9_]; using fallback ID '{base}'", file=sys.stderr)
 
-        new_id = base
-        suffix = 1
+        # Start from the next suffix known to be free for this base; only
+        # loop if base_k happens to collide with another record's ID
+        suffix = next_suffix[base]
+        new_id = base if suffix == 0 else f"{base}_{suffix}"
         while new_id in used_ids:
             # When multiple instances of the same base appear, use _1, _2,... to make them unique
-            new_id = f"{base}_{suffix}"
             suffix += 1
+            new_id = f"{base}_{suffix}"
+        next_suffix[base] = suffix + 1
         if new_id != base:
             print(f"[WARN] Duplicate truncated ID '{base}' detected, renamed to '{new_id}'", file=sys.stderr)
 
         used_ids.add(new_id)
-        new_records.append((new_id, seq))
-        mapping_lines.append(f"{new_id}\t{old_header}")
+        map_out.write(f"{new_id}\t{old_header}\n")
+        yield new_id, seq
+
+def non_negative_int(value):
+    ivalue = int(value)
+    if ivalue < 0:
+        raise argparse.ArgumentTypeError("Value must be a non-negative integer.")
+    return ivalue
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="Truncate FASTA IDs at the first non-alnum/underscore character and output mapping."
+    )
+    ap.add_argument("--in", dest="in_fasta", required=True, help="Input FASTA")
+    ap.add_argument("--out", dest="out_fasta", required=True, help="Output FASTA with truncated IDs")
+    ap.add_argument("--map", dest="map_tsv", required=True, help="Output mapping TSV (new_id<TAB>old_header)")
+    ap.add_argument(
+        "--wrap",
+        type=non_negative_int,
+        default=60,
+        help="Line width for output FASTA sequences (0 = one line per sequence). Default: 60",
+    )
+    args = ap.parse_args()
+
+    records = read_fasta(args.in_fasta)
+    first = next(records, None)
+    if first is None:
+        sys.exit("[ERROR] No sequences found in input FASTA.")
 
-    write_fasta(new_records, args.out_fasta)
+    # Records stream from the parser through renaming into both outputs
     with open(args.map_tsv, "w") as m:
         m.write("new_id\told_header\n")
-        for line in mapping_lines:
-            m.write(line + "\n")
+        n_written = write_fasta(rename_records(chain([first], records), m), args.out_fasta, width=args.wrap)
 
-    print(f"[INFO] Wrote {len(new_records)} sequences to {args.out_fasta}")
+    print(f"[INFO] Wrote {n_written} sequences to {args.out_fasta}")
     print(f"[INFO] Wrote mapping table to {args.map_tsv}")
 
 if __name__ == "__main__":
@@ -20,16 +20,19 @@
 # ============================================================
 
 import argparse
+import re
 from collections import defaultdict  # (currently unused but harmless)
 
 # ---------- Minimal Newick parser (custom implementation) ----------
 
 class Node:
+    __slots__ = ("name", "children", "leafmask")
+
     def __init__(self, name=None):
         # Leaf or internal node name (SzR_..., HeR_..., "240", "Node12", etc.)
         self.name = name
         self.children = []   # list[Node]
-        self.leafset = None  # will be assigned later (frozenset of leaf names)
+        self.leafmask = None  # will be assigned later (int bitset of leaves)
 
 
 def normalize_iqtree_label(name: str) -> str:
@@ -48,73 +51,65 @@ def normalize_iqtree_label(name: str) -> str:
     return name
 
 
+# A token is a single delimiter or a run of anything else up to the next
+# delimiter/whitespace.
+NEWICK_TOKEN_RE = re.compile(r"[(),:;]|[^(),:;\s]+")
+
+
 def tokenize_newick(s):
-    tokens = []
-    buf = []
-    for ch in s.strip():
-        if ch in '(),:;':
-            if buf:
-                tokens.append(''.join(buf))
-                buf = []
-            tokens.append(ch)
-        elif ch.isspace():
-            if buf:
-                tokens.append(''.join(buf))
-                buf = []
-        else:
-            buf.append(ch)
-    if buf:
-        tokens.append(''.join(buf))
-    return tokens
+    return NEWICK_TOKEN_RE.findall(s)
+
+
+def skip_branch_length(tokens, i):
+    """Skip an optional ':<length>' (branch lengths are ignored)."""
+    if i < len(tokens) and tokens[i] == ':':
+        i += 1  # skip ':'
+        if i < len(tokens):
+            i += 1  # skip length token
+    return i
 
 
 def parse_subtree(tokens, i=0):
     """
-    Recursive Newick parser.
+    Iterative Newick parser (explicit stack, so deep trees cannot hit
+    Python's recursion limit).
     Returns: (Node, next_index)
     """
-    if tokens[i] == '(':
-        # Internal node
-        i += 1  # skip '('
-        children = []
-        while True:
-            child, i = parse_subtree(tokens, i)
-            children.append(child)
+    stack = []  # internal nodes whose children are still being read
+
+    while True:
+        # Descend through '(' until a leaf is reached
+        while tokens[i] == '(':
+            stack.append(Node())
+            i += 1  # skip '('
+
+        # Leaf node
+        node = Node(tokens[i])
+        i = skip_branch_length(tokens, i + 1)
+
+        # Attach the finished node to its parent; every ')' completes
+        # the parent, which is then attached in turn.
+        while stack:
+            parent = stack[-1]
+            parent.children.append(node)
             if tokens[i] == ',':
                 i += 1
-                continue
+                break
             elif tokens[i] == ')':
                 i += 1
-                break
+                stack.pop()
+
+                # Optional node name
+                if i < len(tokens) and tokens[i] not in [',', ')', ':', ';']:
+                    parent.name = tokens[i]
+                    i += 1
+
+                i = skip_branch_length(tokens, i)
+                node = parent
             else:
                 raise ValueError(f"Unexpected token after child: {tokens[i]}")
-
-        # Optional node name
-        name = None
-        if i < len(tokens) and tokens[i] not in [',', ')', ':', ';']:
-            name = tokens[i]
-            i += 1
-
-        # Optional branch length (ignored)
-        if i < len(tokens) and tokens[i] == ':':
-            i += 1  # skip ':'
-            if i < len(tokens):
-                i += 1  # skip length token
-
-        node = Node(name)
-        node.children = children
-        return node, i
-    else:
-        # Leaf node
-        name = tokens[i]
-        i += 1
-        # Optional branch length (ignored)
-        if i < len(tokens) and tokens[i] == ':':
-            i += 1
-            if i < len(tokens):
-                i += 1
-        node = Node(name)
-        return node, i
+        else:
+            return node, i
 
 
 def parse_newick_string(s):
@@ -126,26 +121,52 @@ def parse_newick_string(s):
 
 # ---------- Utility functions ----------
 
-def collect_leafsets(node):
+def get_leaf_names(root):
+    """Return the set of leaf names under root."""
+    return {nd.name for nd in iter_nodes(root) if not nd.children}
+
+
+def build_leaf_index(*roots):
+    """
+    Build one leaf name -> bit index table for several trees, so that
+    their leafmasks are directly comparable (equal mask <=> equal leaf set).
+
+    Leaves present in every tree take the low bits; a leaf missing from
+    some tree gets its own high bit, so any clade containing it simply
+    never finds a match.
+    """
+    leaf_sets = [get_leaf_names(r) for r in roots]
+    shared = set.intersection(*leaf_sets)
+    partial = set.union(*leaf_sets) - shared
+    order = sorted(shared) + sorted(partial)
+    return {name: i for i, name in enumerate(order)}
+
+
+def collect_leafsets(root, leaf_bits):
     """
-    Attach a leafset (frozenset of leaf names) to each node.
-    Returns: the set of leaves under this node.
+    Attach a leafmask to each node: an int bitset with bit leaf_bits[name]
+    set for every leaf below it (see build_leaf_index).
+    Returns: the root's leafmask.
     """
-    if not node.children:
-        node.leafset = frozenset([node.name])
-        return {node.name}
-    leaves = set()
-    for ch in node.children:
-        leaves |= collect_leafsets(ch)
-    node.leafset = frozenset(leaves)
-    return leaves
+    # Reversed preorder visits every child before its parent
+    for node in reversed(list(iter_nodes(root))):
+        if not node.children:
+            node.leafmask = 1 << leaf_bits[node.name]
+        else:
+            mask = 0
+            for ch in node.children:
+                mask |= ch.leafmask
+            node.leafmask = mask
+    return root.leafmask
 
 
 def iter_nodes(node):
     """Traverse the tree and yield all nodes (preorder)."""
-    yield node
-    for ch in node.children:
-        yield from iter_nodes(ch)
+    stack = [node]
+    while stack:
+        nd = stack.pop()
+        yield nd
+        stack.extend(reversed(nd.children))
 
 
 # ---------- Main ----------
@@ -174,17 +195,6 @@ def main():
     with open(args.iqtree) as f:
         iq_str = f.read().strip()
     iq_root = parse_newick_string(iq_str)
-    collect_leafsets(iq_root)
-
-    # IQ-TREE: leafset -> NodeXX name
-    iq_clade_to_name = {}
-    for nd in iter_nodes(iq_root):
-        if nd.children and nd.name:
-            norm_name = normalize_iqtree_label(nd.name)
-            if norm_name and norm_name.startswith("Node"):
-                iq_clade_to_name[nd.leafset] = norm_name
-
-    print(f"[INFO] IQ-TREE internal nodes with NodeXX labels: {len(iq_clade_to_name)}")
 
     # --- Parse RAxML side ---
     with open(args.raxml) as f:
@@ -196,9 +206,22 @@ def main():
         print("[INFO] Collapsing ROOT dummy node in RAxML tree")
         rax_root = rax_root.children[0]
 
-    collect_leafsets(rax_root)
+    # --- Leaf masks over one leaf index shared by both trees ---
+    leaf_bits = build_leaf_index(iq_root, rax_root)
+    collect_leafsets(iq_root, leaf_bits)
+    collect_leafsets(rax_root, leaf_bits)
+
+    # IQ-TREE: leafmask -> NodeXX name
+    iq_clade_to_name = {}
+    for nd in iter_nodes(iq_root):
+        if nd.children and nd.name:
+            norm_name = normalize_iqtree_label(nd.name)
+            if norm_name and norm_name.startswith("Node"):
+                iq_clade_to_name[nd.leafmask] = norm_name
+
+    print(f"[INFO] IQ-TREE internal nodes with NodeXX labels: {len(iq_clade_to_name)}")
 
-    # RAxML: leafset -> internal node label (numeric)
+    # RAxML: leafmask -> internal node label (numeric)
     rax_clade_to_name = {}
     for nd in iter_nodes(rax_root):
         if (
@@ -209,16 +232,16 @@ def main():
             and not nd.name.startswith("OG_")
         ):
             # Internal node label (e.g., "229", "230", ...)
-            rax_clade_to_name[nd.leafset] = nd.name
+            rax_clade_to_name[nd.leafmask] = nd.name
 
     print(f"[INFO] RAxML internal nodes with numeric labels: {len(rax_clade_to_name)}")
 
-    # --- Match by leaf set (RAxML → IQ-TREE) ---
+    # --- Match by leaf set (RAxML → IQ-TREE), i.e. by equal leafmask ---
     mapping = {}   # RAxML node label -> IQ-TREE NodeXX
     unmapped = []  # RAxML node labels that could not be mapped
 
-    for leafset, rname in rax_clade_to_name.items():
-        iq_name = iq_clade_to_name.get(leafset)
+    for leafmask, rname in rax_clade_to_name.items():
+        iq_name = iq_clade_to_name.get(leafmask)
         if iq_name is None:
             unmapped.append(rname)
         else:
@@ -241,35 +264,43 @@ def main():
 
             # Sort RAxML internal nodes: numeric labels first (by value), then others (by string)
             def sort_key(item):
-                leafset, rname = item
+                leafmask, rname = item
                 if rname.isdigit():
                     return (0, int(rname))   # numeric first
                 return (1, rname)           # then non-numeric, lexicographically
 
-            for leafset, rname in sorted(rax_clade_to_name.items(), key=sort_key):
-                iq_name = iq_clade_to_name.get(leafset)
+            for leafmask, rname in sorted(rax_clade_to_name.items(), key=sort_key):
+                iq_name = iq_clade_to_name.get(leafmask)
                 status = "mapped" if iq_name is not None else "unmapped"
                 iq_name_out = iq_name if iq_name is not None else ""
-                mt.write(f"{iq_name_out}\t{rname}\t{len(leafset)}\t{status}\n")
+                n_tips = bin(leafmask).count("1")
+                mt.write(f"{iq_name_out}\t{rname}\t{n_tips}\t{status}\n")
 
     # --- Rewrite ancestralStates ---
     n_total = 0
     n_changed = 0
 
-    with open(args.ancestral) as fin, open(args.out, "w") as fout:
+    with open(args.ancestral, buffering=1 << 20) as fin, \
+            open(args.out, "w", buffering=1 << 20) as fout:
+        buf = []  # output lines, flushed with writelines() in batches
         for line in fin:
-            stripped = line.strip()
-            if not stripped:
-                fout.write(line)
+            # Split off the node name only; the state string is kept whole
+            parts = line.split(None, 1)
+            if not parts:
+                buf.append(line)
                 continue
 
-            parts = stripped.split()
             old_name = parts[0]
             new_name = mapping.get(old_name, old_name)
             if new_name != old_name:
                 n_changed += 1
             n_total += 1
-            fout.write(new_name + "\t" + "\t".join(parts[1:]) + "\n")
+            rest = parts[1].rstrip() if len(parts) > 1 else ""
+            buf.append(f"{new_name}\t{rest}\n")
+            if len(buf) >= 4096:
+                fout.writelines(buf)
+                buf.clear()
+        fout.writelines(buf)
 
     print(f"[DONE] ancestralStates written to: {args.out}")
     print(f"[INFO] Lines processed: {n_total}, renamed: {n_changed}")
@@ -19,16 +19,18 @@
 #   python msa_to_binary.py input.fasta output_binary.phy
 # ============================================================
 
+import os
 import sys
-from collections import OrderedDict
+
+# Byte translation table: gap ('-') -> '0', every other byte -> '1'
+BINARY_TABLE = bytes(ord("0") if c == ord("-") else ord("1") for c in range(256))
 
 
 def read_fasta(filename):
     """
-    Read a FASTA file into an OrderedDict: {name: sequence}.
+    Yield (name, sequence) records from a FASTA file one at a time.
     Only the first token on the header line is used as the name.
     """
-    seqs = OrderedDict()
     name = None
     seq = []
 
@@ -41,7 +43,7 @@ def read_fasta(filename):
             if line.startswith(">"):
                 # flush previous sequence
                 if name is not None:
-                    seqs[name] = "".join(seq)
+                    yield name, "".join(seq)
                 # take first token as sequence name
                 name = line[1:].strip().split()[0]
                 seq = []
@@ -49,48 +51,90 @@ def read_fasta(filename):
                 seq.append(line)
 
     if name is not None:
-        seqs[name] = "".join(seq)
+        yield name, "".join(seq)
 
-    return seqs
 
+def count_fasta(filename):
+    """
+    Return (number of records, length of the first sequence).
 
-def to_binary(msa_dict):
+    Records are counted with read_fasta() itself, so the count always
+    agrees with what the second pass yields (e.g. for header lines with
+    leading whitespace); only one record is held at a time.
     """
-    Convert an MSA dictionary {name: amino_acid_sequence}
-    into a binary dictionary {name: 0/1 sequence}.
+    nseq = 0
+    seqlen = 0
+    for nseq, (_, seq) in enumerate(read_fasta(filename), start=1):
+        if nseq == 1:
+            seqlen = len(seq)
+    return nseq, seqlen
+
+
+def to_binary(seq):
     """
-    binary_dict = {}
-    for name, seq in msa_dict.items():
-        binary_seq = []
-        for c in seq:
-            if c == "-":
-                binary_seq.append("0")   # gap = 0
-            else:
-                binary_seq.append("1")   # residue = 1
-        binary_dict[name] = "".join(binary_seq)
-    return binary_dict
+    Convert one aligned amino-acid sequence into its 0/1 row (as ASCII
+    bytes), using a single C-level bytes.translate() call with BINARY_TABLE.
+
+    Sequences are independent, but each call is already a tight C loop,
+    so batching them or spreading them over worker threads/processes
+    costs more in joining, slicing or pickling than it saves.
+    """
+    return seq.encode("ascii", "replace").translate(BINARY_TABLE)
 
 
-def write_phylip(binary_dict, outfile):
+def write_phylip(records, outfile, nseq, seqlen):
     """
     Write a simple PHYLIP-like file:
         <nseq> <seqlen>
         <name> <binary_string>
     Names are left-padded up to 20 characters.
-    """
-    nseq = len(binary_dict)
-    if nseq == 0:
-        raise ValueError("No sequences to write (binary_dict is empty).")
 
-    seqlen_set = {len(s) for s in binary_dict.values()}
-    if len(seqlen_set) != 1:
-        raise ValueError("Sequences have unequal lengths in binary_dict.")
-    seqlen = seqlen_set.pop()
+    `records` is an iterable of (name, amino_acid_sequence); each
+    sequence is converted and written immediately, so the alignment
+    is never held in memory. Rows are appended as bytes to a bytearray
+    that is written out in ~1 MiB blocks, so no per-row str formatting or
+    decode is needed. Returns the set of duplicated names.
 
-    with open(outfile, "w") as f:
-        f.write(f"{nseq} {seqlen}\n")
-        for name, seq in binary_dict.items():
-            f.write(f"{name.ljust(20)} {seq}\n")
+    Rows go to "<outfile>.tmp", which replaces outfile only once every
+    record has been written; on any error it is removed, so no partial
+    PHYLIP file is left behind.
+    """
+    if nseq == 0:
+        raise ValueError("No sequences to write (records is empty).")
+
+    seen = set()
+    duplicates = set()
+    n_written = 0
+    buf = bytearray()
+    tmp_path = f"{outfile}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(f"{nseq} {seqlen}\n".encode())
+            for name, seq in records:
+                n_written += 1
+                if len(seq) != seqlen:
+                    raise ValueError(
+                        f"Sequences have unequal lengths: {name} has {len(seq)}, expected {seqlen}."
+                    )
+                if name in seen:
+                    duplicates.add(name)
+                seen.add(name)
+                buf += name.ljust(20).encode()
+                buf += b" "
+                buf += to_binary(seq)
+                buf += b"\n"
+                if len(buf) >= 1 << 20:
+                    f.write(buf)
+                    buf.clear()
+            f.write(buf)
+        if n_written != nseq:
+            raise ValueError(f"Expected {nseq} sequences but wrote {n_written}.")
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, outfile)
+    return duplicates
 
 
 def main():
@@ -101,26 +145,27 @@ def main():
     infile = sys.argv[1]
     outfile = sys.argv[2]
 
+    # First pass: count records and take the alignment length from the
+    # first sequence, so the PHYLIP header can be written up front.
     print(f"[INFO] Reading {infile} ...")
-    msa = read_fasta(infile)
-    nseq = len(msa)
+    nseq, aln_len = count_fasta(infile)
     print(f"[INFO] {nseq} sequences loaded")
 
     if nseq == 0:
         print("[ERROR] No sequences were found in the input FASTA.", file=sys.stderr)
         sys.exit(1)
 
+    # Second pass: stream each record straight into the PHYLIP file
+    try:
+        duplicates = write_phylip(read_fasta(infile), outfile, nseq, aln_len)
+    except ValueError as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        sys.exit(1)
+
     # quick check for duplicate names
-    if len(msa.keys()) != len(set(msa.keys())):
+    if duplicates:
         print("[WARN] Duplicate sequence names detected in the FASTA headers.", file=sys.stderr)
 
-    binary = to_binary(msa)
-    length_set = {len(s) for s in binary.values()}
-    if len(length_set) != 1:
-        print("[WARN] Unequal sequence lengths detected in the alignment!", file=sys.stderr)
-
-    write_phylip(binary, outfile)
-    aln_len = list(length_set)[0]
     print(f"[DONE] Written to {outfile}")
     print(f"[INFO] Alignment length: {aln_len}")
 
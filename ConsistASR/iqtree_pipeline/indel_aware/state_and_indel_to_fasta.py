@@ -13,6 +13,15 @@
 import argparse
 from collections import defaultdict
 
+import numpy as np
+
+# ASCII codes used by the vectorized merge
+GAP = np.uint8(ord("-"))
+BIT_DELETED = np.uint8(ord("0"))
+# str.translate table deleting '-' (faster than str.replace once
+# sequences carry more than a few percent gaps)
+GAP_DELETE = str.maketrans("", "", "-")
+
 
 # ---------------------------
 # Extract AA sequences for all nodes from IQ-TREE .state
@@ -30,14 +39,16 @@ def parse_state_file(state_file):
     dict[str, str]
         { node_name : amino_acid_sequence }
     """
-    states = defaultdict(list)
+    states = defaultdict(list)   # node -> [AA, ...] in file order
+    sites = defaultdict(list)    # node -> [site, ...] in file order
 
     with open(state_file) as f:
         for line in f:
-            if line.startswith("#") or not line.strip():
+            if line.startswith("#"):
                 continue
 
-            parts = line.strip().split()
+            # Only Node/Site/State are needed; leave the p_* columns unsplit
+            parts = line.split(None, 3)
             if len(parts) < 3:
                 continue
 
@@ -52,13 +63,16 @@ def parse_state_file(state_file):
             except ValueError:
                 continue
 
-            aa = parts[2]
-            states[node].append((site, aa))
+            states[node].append(parts[2])
+            sites[node].append(site)
 
     seqs = {}
-    for node, site_states in states.items():
-        site_states.sort(key=lambda x: x[0])
-        seqs[node] = "".join(aa for _, aa in site_states)
+    for node, aas in states.items():
+        # IQ-TREE writes sites in order; only re-sort if that is not the case
+        site_ids = sites[node]
+        if site_ids != sorted(site_ids):
+            aas = [aa for _, aa in sorted(zip(site_ids, aas), key=lambda x: x[0])]
+        seqs[node] = "".join(aas)
 
     return seqs
 
@@ -75,8 +89,8 @@ def parse_indel_file(indel_file):
 
     Returns
     -------
-    dict[str, list[str]]
-        { node_name : list_of_bits("0"/"1") }
+    dict[str, bytes]
+        { node_name : bit_string(b"0"/b"1") }
     """
     indels = {}
     with open(indel_file) as f:
@@ -88,7 +102,8 @@ def parse_indel_file(indel_file):
             if len(parts) < 2:
                 continue
             name, bits = parts[0], parts[1].strip()
-            indels[name] = list(bits)
+            # One byte per column, ready for np.frombuffer in the merge
+            indels[name] = bits.encode("ascii")
     return indels
 
 
@@ -108,8 +123,8 @@ def merge_state_and_indel(state_dict, indel_dict):
     ----------
     state_dict : dict[str, str]
         { node_name : AA_sequence }
-    indel_dict : dict[str, list[str]]
-        { node_name : list_of_bits }
+    indel_dict : dict[str, bytes]
+        { node_name : bit_string }
 
     Returns
     -------
@@ -131,14 +146,12 @@ def merge_state_and_indel(state_dict, indel_dict):
                 f"state={len(seq)} indel={len(bits)}"
             )
 
-        new_seq = []
-        for aa, bit in zip(seq, bits):
-            if bit == "0":
-                new_seq.append("-")
-            else:
-                # bit == "1" → keep the AA; if AA is already '-', keep '-'
-                new_seq.append(aa if aa != "-" else "-")
-        merged[node] = "".join(new_seq)
+        # One vectorized pass per node: '0' columns become '-', all other
+        # columns keep the AA (an existing '-' stays '-')
+        aa_arr = np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+        bit_arr = np.frombuffer(bits, dtype=np.uint8)
+        merged_arr = np.where(bit_arr == BIT_DELETED, GAP, aa_arr)
+        merged[node] = merged_arr.tobytes().decode("ascii")
 
     if missing_indel:
         print(
@@ -174,9 +187,11 @@ def write_fasta(seqs, outpath, remove_gaps=False):
     remove_gaps : bool, optional
         If True, remove all '-' characters before writing.
     """
-    with open(outpath, "w") as f:
+    # 1 MiB buffer: one record per write() call, flushed to the OS in
+    # large blocks
+    with open(outpath, "w", buffering=1 << 20) as f:
         for name, seq in seqs.items():
-            out_seq = seq.replace("-", "") if remove_gaps else seq
+            out_seq = seq.translate(GAP_DELETE) if remove_gaps else seq
             f.write(f">{name}\n{out_seq}\n")
 
 
@@ -203,6 +218,10 @@ def main():
                         help="Output FASTA (alignment-like, with gaps)")
     parser.add_argument("--out_nogap", default="ASR_final_nogap.fasta",
                         help="Output FASTA (gap-stripped, e.g. AlphaFold input)")
+    parser.add_argument("--skip_withgap", action="store_true",
+                        help="Do not write the --out_withgap FASTA")
+    parser.add_argument("--skip_nogap", action="store_true",
+                        help="Do not write the --out_nogap FASTA")
     args = parser.parse_args()
 
     print(f"[INFO] Reading state file: {args.state}")
@@ -223,14 +242,17 @@ def main():
     if args.out_raw_nogap:
         write_fasta(state_dict, args.out_raw_nogap, remove_gaps=True)
 
-    write_fasta(merged, args.out_withgap, remove_gaps=False)
-    write_fasta(merged, args.out_nogap, remove_gaps=True)
+    if not args.skip_withgap:
+        write_fasta(merged, args.out_withgap, remove_gaps=False)
+
+    if not args.skip_nogap:
+        write_fasta(merged, args.out_nogap, remove_gaps=True)
 
     print("[DONE] Output written:")
     print(f"           raw with gaps : {args.out_raw_withgap}")
     print(f"           raw no gaps   : {args.out_raw_nogap}")
-    print(f"           indel with gaps : {args.out_withgap}")
-    print(f"           indel no gaps   : {args.out_nogap}")
+    print(f"           indel with gaps : {'(skipped)' if args.skip_withgap else args.out_withgap}")
+    print(f"           indel no gaps   : {'(skipped)' if args.skip_nogap else args.out_nogap}")
 
 if __name__ == "__main__":
     main()
@@ -1,56 +1,72 @@
 #!/usr/bin/env python3
 import argparse
+import mmap
 import sys
 import re
 
-def parse_node_index_from_rst(rst_file, paml_node):
-    """
-    Scan `node #` lines in the RST file to collect the order of internal nodes,
-    and return the 0-based index of the given paml_node in that order.
-    """
-    order = []
-    with open(rst_file) as f:
-        for line in f:
-            if line.startswith("node #"):
-                m = re.match(r"node #(\d+)", line)
-                if m:
-                    order.append(int(m.group(1)))
-    if paml_node not in order:
-        sys.exit(f"[ERROR] Node {paml_node} was not found in the RST file.")
-    idx = order.index(paml_node)
-    return idx, order
+# Compiled once and run over the whole memory-mapped .rst file, so the
+# line-by-line scanning happens inside the regex engine. Both patterns
+# start from the preceding newline rather than a (?m)^ anchor, which lets
+# the engine skip ahead with a fast literal search (the first line of an
+# .rst file is the "Supplemental results" banner, never a match).
+# `node #N` lines give the order of internal nodes.
+NODE_RE = re.compile(rb"\nnode #(\d+)")
+# Site lines ("<site_id> <some_int> ...: ...") capture the part after the
+# first ':', which holds one 'A(prob)' entry per node.
+SITE_RE = re.compile(rb"\n[^\S\n]*\d+[^\S\n]+\d+[^\n:]*:([^\n]*)")
+
+# Bytes that str.split() treats as ASCII whitespace
+WHITESPACE = b' \t\n\r\x0b\x0c'
 
-def parse_pp_for_node(rst_file, node_index):
+def parse_rst_once(rst_file, paml_node):
     """
-    From a PAML .rst file, extract the list of posterior probabilities
-    for a given node (node_index) over all alignment columns.
+    Memory-map a PAML .rst file and return (node_index, order, pp_vals).
 
-    The function looks for lines following the
-      'site   Freq   Data:'
-    header, where each site line begins with
-      <site_id> <some_int> ...
-    and contains a series of '(prob)' entries for each node.
+    Two kinds of lines are picked up from the same mapping:
+      - `node #` lines give the order of internal nodes; node_index is the
+        0-based index of paml_node in that order.
+      - site lines following the
+          'site   Freq   Data:'
+        header begin with
+          <site_id> <some_int> ...
+        and contain a series of '(prob)' entries for each node.
 
-    For each site, it collects all '(... )' floats, and then picks
-    the value at position `node_index`.
+    The `node #` lines come after the site table in the .rst file, so the
+    order is collected first (one finditer over the mapping) and the site
+    lines are then scanned with the index already known.
     """
-    pp_vals = []
-    with open(rst_file) as f:
-        for line in f:
-            # Only consider lines that start with "site_number  something"
-            if re.match(r"^\s*\d+\s+\d+", line):
-                parts = line.strip().split(':', 1)
-                if len(parts) < 2:
-                    continue
-                pp_part = parts[1]
-                # Collect all numbers inside parentheses (one per node)
-                m = re.findall(r"\(([0-9\.]+)\)", pp_part)
-                if m and node_index < len(m):
-                    pp_vals.append(float(m[node_index]))
-                else:
-                    # If parsing fails, append 0.0 as a placeholder
-                    pp_vals.append(0.0)
-    return pp_vals
+    with open(rst_file, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and pipes cannot be mapped
+            buf = f.read()
+        try:
+            order = [int(n) for n in NODE_RE.findall(buf)]
+            if paml_node not in order:
+                sys.exit(f"[ERROR] Node {paml_node} was not found in the RST file.")
+            node_index = order.index(paml_node)
+
+            # The k-th '(prob)' entry is the text after the (k+1)-th '(' up to
+            # the next ')'; splitting with maxsplit stops there, so entries for
+            # later nodes are never scanned.
+            n_split = node_index + 1
+            pp_vals = []
+            for site in SITE_RE.finditer(buf):
+                parts = site.group(1).split(b"(", n_split)
+                if len(parts) > n_split:
+                    entry = parts[n_split]
+                    try:
+                        pp_vals.append(float(entry[:entry.index(b")")]))
+                        continue
+                    except ValueError:
+                        pass
+                # If parsing fails, append 0.0 as a placeholder
+                pp_vals.append(0.0)
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+    return node_index, order, pp_vals
 
 def read_withgap_length(path):
     """
@@ -60,15 +76,24 @@ def read_withgap_length(path):
     This is used only for a length consistency check; indel masks are NOT
     constructed here.
     """
-    seq = []
-    with open(path) as f:
+    n = 0
+    with open(path, 'rb') as f:
+        # Skip to the first header line
         for line in f:
-            if line.startswith('>'):
-                if seq:
-                    break  # only use the first sequence
-                continue
-            seq.append(line.strip())
-    return len(''.join(seq))
+            if line.startswith(b'>'):
+                break
+        # Then count non-whitespace bytes in 1 MiB blocks up to the next
+        # header ("\n>", which may straddle two blocks); the sequence
+        # itself is never assembled
+        prev = b'\n'
+        for block in iter(lambda: f.read(1 << 20), b''):
+            end = 0 if prev + block[:1] == b'\n>' else block.find(b'\n>')
+            if end >= 0:
+                n += len(block[:end].translate(None, WHITESPACE))
+                break
+            n += len(block.translate(None, WHITESPACE))
+            prev = block[-1:]
+    return n
 
 def main():
     ap = argparse.ArgumentParser(
@@ -85,12 +110,11 @@ def main():
                     help='Output PP file (one value per line)')
     args = ap.parse_args()
 
-    # 1) Determine the node index in the internal-node order
-    node_index, order = parse_node_index_from_rst(args.rst, args.paml_node)
+    # 1) Determine the node index in the internal-node order and
+    # 2) extract PP values for this node over all alignment columns,
+    #    both from a single mapping of the .rst file
+    node_index, order, pp_vals = parse_rst_once(args.rst, args.paml_node)
     print(f"[INFO] Node {args.paml_node} index: {node_index} / {len(order)}")
-
-    # 2) Extract PP values for this node over all alignment columns
-    pp_vals = parse_pp_for_node(args.rst, node_index)
     print(f"[INFO] Extracted PP length (PAML alignment columns) = {len(pp_vals)}")
 
     # 3) If withgap FASTA is provided, check alignment length
@@ -106,10 +130,9 @@ def main():
             pp_vals = pp_vals[:L]
             print(f"[INFO] PP length after truncation = {len(pp_vals)}")
 
-    # 4) Write out one PP value per line
+    # 4) Write out one PP value per line (formatted up front, one write)
     with open(args.out, "w") as out:
-        for v in pp_vals:
-            out.write(f"{v:.6f}\n")
+        out.write("".join([f"{v:.6f}\n" for v in pp_vals]))
 
     print(f"[OK] Wrote PP (one value per alignment column) to {args.out}")
 
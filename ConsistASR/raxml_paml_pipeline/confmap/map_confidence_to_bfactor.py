@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 import argparse
 import sys
-import math
 import gemmi
+import numpy as np
 
 # 3-letter to 1-letter amino acid code
 AA3_TO_1 = {
@@ -25,79 +25,93 @@ def read_cif_sequence_and_plddt(cif_path, chain_id=None):
     mdl = st[0]
     chains = [ch for ch in mdl]
 
-    def is_polymer_chain(ch):
+    def scan_chain(ch):
+        """
+        One pass over the residues of a chain, returning
+        (sequence, atoms per residue, is_polymer, number of residues).
+        Only polymer residues contribute to the sequence and atom lists.
+        """
+        seq = []
+        res_atoms = []
+        n_res = 0
         for res in ch:
-            if getattr(res, "entity_type", None) == gemmi.EntityType.Polymer:
-                return True
-        return False
+            n_res += 1
+            if getattr(res, "entity_type", None) != gemmi.EntityType.Polymer:
+                continue
+            aa3 = res.name.strip().upper()
+            seq.append(AA3_TO_1.get(aa3, 'X'))
+            res_atoms.append([atom for atom in res])
+        return ''.join(seq), res_atoms, bool(res_atoms), n_res
 
-    # --- chain selection ---
+    # --- chain selection (each candidate chain is read once) ---
     if chain_id:
         ch = next((c for c in chains if c.name.strip() == chain_id.strip()), None)
         if ch is None:
             sys.exit(f"[ERROR] Chain '{chain_id}' not found in structure.")
-        if not is_polymer_chain(ch):
+        seq, res_atoms, is_poly, _ = scan_chain(ch)
+        if not is_poly:
             sys.exit(f"[ERROR] Chain '{chain_id}' is not a polymer chain.")
     else:
-        polys = [c for c in chains if is_polymer_chain(c)]
+        polys = []
+        for c in chains:
+            scanned = scan_chain(c)
+            if scanned[2]:
+                polys.append((c, scanned))
         if not polys:
             sys.exit("[ERROR] No polymer chain found in structure.")
         # pick the polymer chain with the largest number of residues
-        ch = max(polys, key=lambda c: sum(1 for _ in c))
+        ch, (seq, res_atoms, _, _) = max(polys, key=lambda p: p[1][3])
         chain_id = ch.name
 
-    # --- build sequence and atom list per residue ---
-    seq = []
-    res_atoms = []
-    for res in ch:
-        if getattr(res, "entity_type", None) != gemmi.EntityType.Polymer:
-            continue
-        aa3 = res.name.strip().upper()
-        aa1 = AA3_TO_1.get(aa3, 'X')
-        seq.append(aa1)
-        atoms = [atom for atom in res]
-        res_atoms.append(atoms)
-
-    return ''.join(seq), res_atoms, st, chain_id
+    return seq, res_atoms, st, chain_id
 
 def read_fasta_first_seq(path):
     """Read the first sequence (concatenated) from a FASTA file."""
-    seq = []
+    chunks = []
     with open(path) as f:
+        # Skip to the first header line
         for line in f:
             if line.startswith('>'):
-                continue
-            seq.append(line.strip())
-    return ''.join(seq)
+                break
+        # Then read 1 MiB blocks until the next header ("\n>", which may
+        # straddle two blocks) and keep everything before it. end is an
+        # index into block: 0 when the previous block ended with '\n' and
+        # this one starts with '>'
+        prev = '\n'
+        for block in iter(lambda: f.read(1 << 20), ''):
+            end = 0 if prev + block[:1] == '\n>' else block.find('\n>')
+            if end >= 0:
+                chunks.append(block[:end])
+                break
+            chunks.append(block)
+            prev = block[-1]
+    seq = ''.join(''.join(chunks).split())
+    return seq
 
 def read_pp_values(path):
-    """Read per-site PP values (one float per line)."""
-    vals = []
+    """Read per-site PP values (one float per line) as a float64 array."""
     with open(path) as f:
-        for line in f:
-            s = line.strip()
-            if not s:
-                continue
+        lines = [s for s in (line.strip() for line in f) if s]
+    try:
+        return np.array(lines, dtype=np.float64)
+    except ValueError:
+        for s in lines:
             try:
-                vals.append(float(s))
+                float(s)
             except ValueError:
                 sys.exit(f"[ERROR] Non-numeric PP value in {path}: {s}")
-    return vals
+        raise
 
 def make_ungapped_to_aln_map(aln_seq):
     """
     From an aligned sequence with gaps ('-'), return:
       - ungapped sequence (string),
-      - a list mapping ungapped indices (0-based) to
+      - an int array mapping ungapped indices (0-based) to
         alignment columns (0-based).
     """
-    map_list = []
-    ungapped = []
-    for i, c in enumerate(aln_seq):
-        if c != '-':
-            map_list.append(i)
-            ungapped.append(c)
-    return ''.join(ungapped), map_list
+    cols = np.frombuffer(aln_seq.encode('ascii', 'replace'), dtype=np.uint8)
+    map_arr = np.flatnonzero(cols != ord('-'))
+    return aln_seq.replace('-', ''), map_arr
 
 def report_seq_mismatch(name_a, seq_a, name_b, seq_b, max_show=50):
     """Print a brief report if two sequences do not match."""
@@ -117,30 +131,49 @@ def report_seq_mismatch(name_a, seq_a, name_b, seq_b, max_show=50):
 
 def scale_pp_to_100(pp_vals):
     """
-    Automatically scale PP values to 0–100:
+    Automatically scale PP values (array) to 0–100:
       - if max(pp) <= 1.0, treat as 0–1 and multiply by 100,
       - otherwise assume values are already in 0–100.
+    NaN entries are ignored when taking the maximum.
     """
-    mx = max(pp_vals) if pp_vals else 1.0
+    mx = np.nanmax(pp_vals) if pp_vals.size else 1.0
     if mx <= 1.00001:   # assume 0–1
-        return [v*100.0 for v in pp_vals], "0–1→×100"
+        return pp_vals * 100.0, "0–1→×100"
     else:
         return pp_vals, "already 0–100"
 
+def mean_b_per_residue(res_atoms):
+    """
+    Return the mean B-factor (pLDDT for AlphaFold models) of each residue
+    as an array; residues without atoms get 0.0.
+
+    All b_iso values are gathered into one flat array and summed per
+    residue with np.add.reduceat over the residue start offsets.
+    """
+    sizes = np.fromiter((len(atoms) for atoms in res_atoms), dtype=np.int64, count=len(res_atoms))
+    b_flat = np.fromiter((a.b_iso for atoms in res_atoms for a in atoms), dtype=np.float64, count=int(sizes.sum()))
+    offsets = np.cumsum(sizes) - sizes
+    means = np.zeros(len(sizes))
+    # reduceat needs strictly increasing in-range offsets, so empty
+    # residues (which contribute no atoms) are left out
+    nonempty = sizes > 0
+    if b_flat.size:
+        means[nonempty] = np.add.reduceat(b_flat, offsets[nonempty]) / sizes[nonempty]
+    return means
+
 def write_pdb_with_b(st, res_atoms, bvals, out_path):
     """
     Write a PDB file where all atoms in residue i get
     the same B-factor bvals[i].
     """
-    idx = 0
-    for atoms in res_atoms:
-        if idx >= len(bvals):
-            print(f"[WARN] B-factor array shorter than residues; skipping from index {idx}")
-            break
-        bval = bvals[idx]
+    # gemmi has no bulk B-factor setter, so atoms are still assigned one by
+    # one; plain Python floats avoid a numpy scalar conversion per atom
+    bvals = np.asarray(bvals, dtype=np.float64).tolist()
+    if len(bvals) < len(res_atoms):
+        print(f"[WARN] B-factor array shorter than residues; skipping from index {len(bvals)}")
+    for atoms, bval in zip(res_atoms, bvals):
         for atom in atoms:
             atom.b_iso = bval
-        idx += 1
 
     with open(out_path, "w") as f:
         f.write(st.make_pdb_string())
@@ -198,20 +231,11 @@ def main():
     # 5) Re-map PP (0–100) to per-residue order
     pp_scaled, scale_info = scale_pp_to_100(pp_vals)
     print(f"[INFO] PP scale: {scale_info}")
-    per_res_pp = []
-    for u, aln_col in enumerate(map_u2aln):
-        v = pp_scaled[aln_col]
-        v = 0.0 if math.isnan(v) else max(0.0, min(100.0, v))
-        per_res_pp.append(v)
+    # NaN -> 0, then clamp to [0, 100]
+    per_res_pp = np.clip(np.nan_to_num(pp_scaled[map_u2aln], nan=0.0), 0.0, 100.0)
 
     # 6) Compute per-residue pLDDT (mean B-factor per residue)
-    per_res_plddt = []
-    for atoms in res_atoms:
-        if not atoms:
-            per_res_plddt.append(0.0)
-            continue
-        mean_b = sum(a.b_iso for a in atoms) / len(atoms)
-        per_res_plddt.append(mean_b)
+    per_res_plddt = mean_b_per_residue(res_atoms)
 
     # 7) Decide which metric to map to B-factor
     if args.mode == 'pp':
@@ -221,10 +245,10 @@ def main():
     elif args.mode == 'diff':
         # Here we store pLDDT - PP (both assumed 0–100)
         # Any scaling to 0–100 can be applied externally if desired.
-        bvals = [pl - pp for pl, pp in zip(per_res_plddt, per_res_pp)]
+        bvals = per_res_plddt - per_res_pp
     else:  # prod
         # PP × pLDDT / 100 → 0–100
-        bvals = [(pp * pl) / 100.0 for pp, pl in zip(per_res_pp, per_res_plddt)]
+        bvals = (per_res_pp * per_res_plddt) / 100.0
 
     # 8) Write PDB
     write_pdb_with_b(st, res_atoms, bvals, args.out)
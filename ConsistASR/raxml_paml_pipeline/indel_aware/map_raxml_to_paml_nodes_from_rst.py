@@ -22,75 +22,74 @@ import re
 # ---------- Minimal Newick parser ----------
 
 class Node:
+    __slots__ = ("name", "children", "leafmask")
+
     def __init__(self, name=None):
         # Leaf or internal node name
         self.name = name
         self.children = []        # list[Node]
-        self.leafset = None       # frozenset of leaf names
+        self.leafmask = None      # int bitset of leaves (see build_leaf_index)
+
+
+# A token is a single delimiter or a run of anything else up to the next
+# delimiter/whitespace.
+NEWICK_TOKEN_RE = re.compile(r"[(),:;]|[^(),:;\s]+")
 
 
 def tokenize_newick(s):
-    tokens = []
-    buf = []
-    for ch in s.strip():
-        if ch in '(),:;':
-            if buf:
-                tokens.append(''.join(buf))
-                buf = []
-            tokens.append(ch)
-        elif ch.isspace():
-            if buf:
-                tokens.append(''.join(buf))
-                buf = []
-        else:
-            buf.append(ch)
-    if buf:
-        tokens.append(''.join(buf))
-    return tokens
+    return NEWICK_TOKEN_RE.findall(s)
+
+
+def skip_branch_length(tokens, i):
+    """Skip an optional ':<length>' (branch lengths are ignored)."""
+    if i < len(tokens) and tokens[i] == ':':
+        i += 1  # skip ':'
+        if i < len(tokens):
+            i += 1  # skip length token
+    return i
 
 
 def parse_subtree(tokens, i=0):
-    if tokens[i] == '(':
-        # Internal node
-        i += 1  # skip '('
-        children = []
-        while True:
-            child, i = parse_subtree(tokens, i)
-            children.append(child)
+    """
+    Iterative Newick parser (explicit stack, so deep trees cannot hit
+    Python's recursion limit).
+    Returns: (Node, next_index)
+    """
+    stack = []  # internal nodes whose children are still being read
+
+    while True:
+        # Descend through '(' until a leaf is reached
+        while tokens[i] == '(':
+            stack.append(Node())
+            i += 1  # skip '('
+
+        # Leaf node
+        node = Node(tokens[i])
+        i = skip_branch_length(tokens, i + 1)
+
+        # Attach the finished node to its parent; every ')' completes
+        # the parent, which is then attached in turn.
+        while stack:
+            parent = stack[-1]
+            parent.children.append(node)
             if tokens[i] == ',':
                 i += 1
-                continue
+                break
             elif tokens[i] == ')':
                 i += 1
-                break
-            else:
-                raise ValueError(f"Unexpected token after child: {tokens[i]}")
+                stack.pop()
 
-        # Optional node name
-        name = None
-        if i < len(tokens) and tokens[i] not in [',', ')', ':', ';']:
-            name = tokens[i]
-            i += 1
+                # Optional node name
+                if i < len(tokens) and tokens[i] not in [',', ')', ':', ';']:
+                    parent.name = tokens[i]
+                    i += 1
 
-        # Optional branch length (ignored)
-        if i < len(tokens) and tokens[i] == ':':
-            i += 1
-            if i < len(tokens):
-                i += 1
-
-        node = Node(name)
-        node.children = children
-        return node, i
-    else:
-        # Leaf
-        name = tokens[i]
-        i += 1
-        if i < len(tokens) and tokens[i] == ':':
-            i += 1
-            if i < len(tokens):
-                i += 1
-        node = Node(name)
-        return node, i
+                i = skip_branch_length(tokens, i)
+                node = parent
+            else:
+                raise ValueError(f"Unexpected token after child: {tokens[i]}")
+        else:
+            return node, i
 
 
 def parse_newick_string(s):
@@ -100,38 +99,52 @@ def parse_newick_string(s):
 
 # ---------- Utility functions ----------
 
-def collect_leafsets(node):
+def build_leaf_index(*roots):
+    """
+    Build one leaf name -> bit index table for several trees, so that
+    their leafmasks are directly comparable (equal mask <=> equal leaf set).
+
+    Leaves present in every tree take the low bits; a leaf missing from
+    some tree gets its own high bit, so any clade containing it simply
+    never finds a match.
+    """
+    leaf_sets = [get_leaf_names(r) for r in roots]
+    shared = set.intersection(*leaf_sets)
+    partial = set.union(*leaf_sets) - shared
+    order = sorted(shared) + sorted(partial)
+    return {name: i for i, name in enumerate(order)}
+
+
+def collect_leafsets(root, leaf_bits):
     """
-    Recursively compute and attach a leafset (frozenset of leaf names)
-    to each node. Returns the set of leaves under this node.
+    Attach a leafmask to each node: an int bitset with bit leaf_bits[name]
+    set for every leaf below it (see build_leaf_index).
+    Returns: the root's leafmask.
     """
-    if not node.children:
-        node.leafset = frozenset([node.name])
-        return {node.name}
-    leaves = set()
-    for ch in node.children:
-        leaves |= collect_leafsets(ch)
-    node.leafset = frozenset(leaves)
-    return leaves
+    # Reversed preorder visits every child before its parent
+    for node in reversed(list(iter_nodes(root))):
+        if not node.children:
+            node.leafmask = 1 << leaf_bits[node.name]
+        else:
+            mask = 0
+            for ch in node.children:
+                mask |= ch.leafmask
+            node.leafmask = mask
+    return root.leafmask
 
 
 def iter_nodes(node):
     """Preorder traversal over all nodes."""
-    yield node
-    for ch in node.children:
-        yield from iter_nodes(ch)
+    stack = [node]
+    while stack:
+        nd = stack.pop()
+        yield nd
+        stack.extend(reversed(nd.children))
 
 
-def get_leaf_names(node, acc=None):
+def get_leaf_names(node):
     """Collect all leaf names under the given node."""
-    if acc is None:
-        acc = set()
-    if not node.children:
-        acc.add(node.name)
-    else:
-        for ch in node.children:
-            get_leaf_names(ch, acc)
-    return acc
+    return {nd.name for nd in iter_nodes(node) if not nd.children}
 
 
 def transform_leaf_names_tail(root):
@@ -143,10 +156,11 @@ def transform_leaf_names_tail(root):
     for nd in iter_nodes(root):
         if nd.children:
             continue
-        name = nd.name
-        m = re.match(r'^\d+_(.+)$', name)
-        if m:
-            nd.name = m.group(1)
+        # Same as re.match(r'^\d+_(.+)$', name): the part before the first
+        # '_' must be all digits and the rest non-empty
+        prefix, sep, rest = nd.name.partition('_')
+        if sep and rest and prefix.isdecimal():
+            nd.name = rest
 
 # ---------- Extract PAML tree from rst ----------
 
@@ -253,36 +267,32 @@ def main():
     print(f"[INFO] RAxML leaves example:       {sorted(list(rax_leaf))[:5]}")
     print(f"[INFO] Leaf-name overlap size:     {len(paml_leaf_tail & rax_leaf)}")
 
-    # --- Compute leafsets for all nodes ---
-    collect_leafsets(paml_root)
-    collect_leafsets(rax_root)
+    # --- Leaf masks over one leaf index shared by both trees ---
+    leaf_bits = build_leaf_index(paml_root, rax_root)
+    collect_leafsets(paml_root, leaf_bits)
+    collect_leafsets(rax_root, leaf_bits)
 
-    # PAML: leafset -> internal node label
-    paml_clade_to_name = {}
-    for nd in iter_nodes(paml_root):
-        if nd.children and nd.name:
-            paml_clade_to_name[nd.leafset] = nd.name
+    # PAML: leafmask -> internal node label
+    paml_clade_to_name = {
+        nd.leafmask: nd.name for nd in iter_nodes(paml_root) if nd.children and nd.name
+    }
 
     print(f"[INFO] PAML internal nodes with labels: {len(paml_clade_to_name)}")
 
-    # RAxML: leafset -> internal node label
-    rax_clade_to_name = {}
-    for nd in iter_nodes(rax_root):
-        if nd.children and nd.name:
-            rax_clade_to_name[nd.leafset] = nd.name
+    # RAxML: leafmask -> internal node label
+    rax_clade_to_name = {
+        nd.leafmask: nd.name for nd in iter_nodes(rax_root) if nd.children and nd.name
+    }
 
     print(f"[INFO] RAxML internal nodes with labels: {len(rax_clade_to_name)}")
 
-    # --- Match by leaf set: RAxML → PAML ---
-    mapping = {}   # RAxML node label -> PAML node label
-    unmapped = []
-
-    for leafset, rname in rax_clade_to_name.items():
-        paml_name = paml_clade_to_name.get(leafset)
-        if paml_name is None:
-            unmapped.append(rname)
-        else:
-            mapping[rname] = paml_name
+    # --- Match by leaf set: RAxML → PAML, i.e. by equal leafmask ---
+    # One lookup per RAxML clade, shared by the mapped/unmapped split
+    rax_names = list(rax_clade_to_name.values())
+    paml_hits = list(map(paml_clade_to_name.get, rax_clade_to_name))
+    # RAxML node label -> PAML node label
+    mapping = {r: p for r, p in zip(rax_names, paml_hits) if p is not None}
+    unmapped = [r for r, p in zip(rax_names, paml_hits) if p is None]
 
     print(f"[INFO] Mapped internal nodes: {len(mapping)}")
     if unmapped:
@@ -298,35 +308,43 @@ def main():
             mt.write("paml_node\traxml_node\tn_tips\tstatus\n")
 
             def sort_key(item):
-                leafset, rname = item
+                leafmask, rname = item
                 if rname.isdigit():
                     return (0, int(rname))
                 return (1, rname)
 
-            for leafset, rname in sorted(rax_clade_to_name.items(), key=sort_key):
-                paml_name = paml_clade_to_name.get(leafset)
+            for leafmask, rname in sorted(rax_clade_to_name.items(), key=sort_key):
+                paml_name = paml_clade_to_name.get(leafmask)
                 status = "mapped" if paml_name is not None else "unmapped"
                 paml_name_out = paml_name if paml_name is not None else ""
-                mt.write(f"{paml_name_out}\t{rname}\t{len(leafset)}\t{status}\n")
+                n_tips = bin(leafmask).count("1")
+                mt.write(f"{paml_name_out}\t{rname}\t{n_tips}\t{status}\n")
 
     # --- Rewrite RAxML_marginalAncestralStates node labels ---
     n_total = 0
     n_changed = 0
 
-    with open(args.ancestral) as fin, open(args.out, "w") as fout:
+    with open(args.ancestral, buffering=1 << 20) as fin, \
+            open(args.out, "w", buffering=1 << 20) as fout:
+        buf = []  # output lines, flushed with writelines() in batches
         for line in fin:
-            stripped = line.strip()
-            if not stripped:
-                fout.write(line)
+            # Split off the node name only; the state string is kept whole
+            parts = line.split(None, 1)
+            if not parts:
+                buf.append(line)
                 continue
 
-            parts = stripped.split()
             old_name = parts[0]
             new_name = mapping.get(old_name, old_name)
             if new_name != old_name:
                 n_changed += 1
             n_total += 1
-            fout.write(new_name + "\t" + "\t".join(parts[1:]) + "\n")
+            rest = parts[1].rstrip() if len(parts) > 1 else ""
+            buf.append(f"{new_name}\t{rest}\n")
+            if len(buf) >= 4096:
+                fout.writelines(buf)
+                buf.clear()
+        fout.writelines(buf)
 
     print(f"[DONE] ancestralStates written to: {args.out}")
     print(f"[INFO] Lines processed: {n_total}, renamed: {n_changed}")
@@ -19,81 +19,137 @@
 # ============================================================
 
 import argparse
+import mmap
+import os
 import re
-from collections import defaultdict
+
+import numpy as np
+
+# ASCII codes used by the vectorized merge
+GAP = np.uint8(ord("-"))
+BIT_DELETED = np.uint8(ord("0"))
+# Deleted with bytes.translate when writing gap-stripped FASTA
+GAP_BYTES = b"-"
 
 
 # ---------------------------
 # Extract AA sequences for all nodes from PAML rst
 # ---------------------------
 
-def parse_all_nodes_from_rst(rst_path):
+# "# <id>" part of a "node # <id>" header. The whole mapped file is
+# scanned for it: anchoring on the literal '#' lets the regex engine jump
+# between candidates with a fast search, whereas a case-insensitive
+# "node" prefix is tried at every byte. The text before the '#' is then
+# checked by is_header_prefix().
+NODE_ID_RE = re.compile(rb"#[^\S\n]*(\d+)\b")
+# Every byte except upper-case A-Z; deleting these with bytes.translate
+# keeps exactly the AA letters of a line
+NON_AA_BYTES = bytes(c for c in range(256) if not ord("A") <= c <= ord("Z"))
+# Lines (after strip) that end a node's sequence block; an empty line
+# also ends it
+BLOCK_END_PREFIXES = (b"node #", b"TREE", b"Ancestral", b"Probab")
+
+
+def is_header_prefix(head):
     """
-    Parse all "node # <id>" blocks from a PAML rst file and return:
-
-        { '229': 'AA....', '230': 'AA....', ... }
-
-    This is a generalization of parse_single_node_from_rst()
-    from extract_multi_node_indel.py to handle all nodes at once.
+    True if `head`, the part of a line before its '#', is "node" (any
+    case) followed by whitespace, optionally indented.
     """
-    node_seqs = defaultdict(list)
-    current_id = None
-    grabbing = False
+    return head[-1:].isspace() and head.strip().lower() == b"node"
 
-    with open(rst_path, encoding="utf-8") as f:
-        for line in f:
-            raw = line.rstrip("\n")
-
-            # Detect header line: "node # <id>"
-            m = re.match(r"^\s*node\s+#\s*(\d+)\b", raw, flags=re.IGNORECASE)
-            if m:
-                node_id = m.group(1)  # e.g., '229'
-                current_id = node_id
-                grabbing = True
-
-                # Some AA characters may already appear on the header line
-                tail = raw.split("#", 1)[-1]
-                pieces = re.findall(r"[A-Z]+", tail)
-                if pieces:
-                    node_seqs[current_id].append("".join(pieces))
-                continue
 
-            if grabbing:
-                s = raw.strip()
-                # Block termination: next node or TREE/Ancestral/Probab/empty line
-                if (
-                    s.startswith("node #")
-                    or s.startswith("TREE")
-                    or s.startswith("Ancestral")
-                    or s.startswith("Probab")
-                    or s == ""
-                ):
-                    current_id = None
-                    grabbing = False
-                    continue
-
-                letters = re.findall(r"[A-Z]+", s)
-                if letters and current_id is not None:
-                    node_seqs[current_id].append("".join(letters))
+def is_node_header(line):
+    """True if a single line (bytes, no newline) is a "node # <id>" header."""
+    pos = line.find(b"#")
+    return (pos > 0 and is_header_prefix(line[:pos])
+            and NODE_ID_RE.match(line, pos) is not None)
 
-    # Join collected chunks per node
-    seq_dict = {nid: "".join(chunks) for nid, chunks in node_seqs.items()}
 
-    if not seq_dict:
-        raise ValueError(f"No node sequences found in {rst_path}")
+def iter_nodes_from_rst(rst_path):
+    """
+    Yield (node_id, seq) for every "node # <id>" block of a PAML rst file,
+    e.g. (b'229', b'AA....'), in file order. Both are ASCII bytes: the
+    node ID is only used as a dict key and a FASTA header, so it is
+    never decoded.
 
-    # Optional: length consistency check
-    lengths = {len(s) for s in seq_dict.values()}
-    if len(lengths) != 1:
-        print(f"[WARN] PAML rst sequences have multiple lengths: {lengths}")
+    This is a generalization of parse_single_node_from_rst()
+    from extract_multi_node_indel.py to handle all nodes at once.
 
-    return seq_dict
+    The file is memory-mapped and the headers are located with one
+    NODE_ID_RE.finditer pass, so only the header lines and the
+    few lines of each node block are looked at from Python; the rest
+    of the rst (site tables etc.) is skipped by the regex engine.
+    Each sequence is yielded as soon as its block ends, so callers can
+    process nodes one at a time without holding all of them.
+    """
+    with open(rst_path, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and pipes cannot be mapped
+            buf = f.read()
+        try:
+            size = len(buf)
+
+            for m in NODE_ID_RE.finditer(buf):
+                # Only "node" (plus whitespace) may precede the '#' on its line
+                hash_pos = m.start()
+                line_start = buf.rfind(b"\n", 0, hash_pos) + 1
+                if not is_header_prefix(buf[line_start:hash_pos]):
+                    continue
+                line_end = buf.find(b"\n", m.end())
+                if line_end < 0:
+                    line_end = size
+                node_id = m.group(1)  # e.g., b'229'
+
+                # Some AA characters may already appear on the header line;
+                # in PAML's sequence list the whole sequence is there
+                seq = buf[hash_pos + 1:line_end].translate(None, NON_AA_BYTES)
+
+                # Following lines belong to this node until the block ends.
+                # A bytearray is only set up if there are any, so the usual
+                # single-line block is yielded without further copies.
+                grown = None
+                pos = line_end + 1
+                while pos < size:
+                    nl = buf.find(b"\n", pos)
+                    if nl < 0:
+                        nl = size
+                    line = buf[pos:nl]
+                    s = line.strip()
+                    # Block termination: next node or TREE/Ancestral/Probab/empty line
+                    if not s or s.startswith(BLOCK_END_PREFIXES) or is_node_header(line):
+                        break
+                    if grown is None:
+                        grown = bytearray(seq)
+                    grown += s.translate(None, NON_AA_BYTES)
+                    pos = nl + 1
+                if grown is not None:
+                    seq = bytes(grown)
+
+                if seq:
+                    yield node_id, seq
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
 
 
 # ---------------------------
 # Parse indel (0/1 pattern) file
 # ---------------------------
 
+# The only bytes of a 0/1 indel pattern
+BIT_CHARS = b"01"
+
+
+def bits_to_array(bits):
+    """
+    Return a 0/1 pattern (bytes) as a contiguous uint8 array of ASCII
+    codes (b'0' / b'1'), one byte per column.
+    """
+    return np.frombuffer(bits, dtype=np.uint8)
+
+
 def parse_indel_file(indel_file):
     """
     Parse a RAxML-derived indel file.
@@ -106,11 +162,14 @@ def parse_indel_file(indel_file):
 
     Returns
     -------
-    dict[str, list[str]]
-        { node_name : ['1','0','1', ...] }
+    dict[bytes, np.ndarray]
+        { node_name : uint8 array of b'0' / b'1' (see bits_to_array) }
+
+    The file is read in binary mode and node names are kept as bytes,
+    matching the node IDs yielded by iter_nodes_from_rst().
     """
     indels = {}
-    with open(indel_file, encoding="utf-8") as f:
+    with open(indel_file, "rb") as f:
         for line in f:
             line = line.strip()
             if not line:
@@ -119,10 +178,13 @@ def parse_indel_file(indel_file):
             if len(parts) < 2:
                 continue
             name, bits = parts[0], parts[1].strip()
-            if not re.fullmatch(r"[01]+", bits):
+            # Stripping every '0'/'1' leaves nothing only for a pure 0/1
+            # pattern (bits is non-empty after split())
+            if bits.strip(BIT_CHARS):
                 # Ignore non-pattern lines (e.g., headers)
                 continue
-            indels[name] = list(bits)
+            # One byte per column, used directly by the vectorized merge
+            indels[name] = bits_to_array(bits)
 
     if not indels:
         raise ValueError(f"No valid 0/1 patterns found in {indel_file}")
@@ -134,9 +196,10 @@ def parse_indel_file(indel_file):
 # Merge ASR AA states with indel patterns
 # ---------------------------
 
-def merge_state_and_indel(state_dict, indel_dict):
+def merge_one(node, seq, bit_arr):
     """
-    Merge AA sequences from PAML rst with RAxML indel (0/1) patterns.
+    Merge the AA sequence of one node from PAML rst with its RAxML
+    indel (0/1) pattern.
 
     Rules:
       bit = '0' → '-' (deletion) at that position
@@ -144,77 +207,124 @@ def merge_state_and_indel(state_dict, indel_dict):
 
     Parameters
     ----------
-    state_dict : dict[str, str]
-        { node_name : AA_sequence }
-        e.g., { '229': 'MKT...', ... }
-    indel_dict : dict[str, list[str]]
-        { node_name : list_of_bits }
-        e.g., { '229': ['1','0',...], ... }
+    node : bytes
+        Node name (used in the error message only)
+    seq : bytes
+        AA sequence as ASCII bytes
+    bit_arr : np.ndarray
+        uint8 array of b'0' / b'1' (see bits_to_array)
 
     Returns
     -------
-    dict[str, str]
-        { node_name : merged_sequence_with_indels }
+    bytes
+        merged sequence with indels applied
     """
-    merged = {}
-    missing_indel = []
-
-    for node, seq in state_dict.items():
-        if node not in indel_dict:
-            missing_indel.append(node)
-            continue
-
-        bits = indel_dict[node]
-        if len(bits) != len(seq):
-            raise ValueError(
-                f"[ERROR] Length mismatch for node {node}: "
-                f"state={len(seq)} indel={len(bits)}"
-            )
-
-        new_seq = []
-        for aa, bit in zip(seq, bits):
-            if bit == "0":
-                new_seq.append("-")
-            else:
-                # bit == "1" → use AA as is (preserve '-' if present)
-                new_seq.append(aa if aa != "-" else "-")
-        merged[node] = "".join(new_seq)
-
-    if missing_indel:
-        print(
-            f"[WARN] {len(missing_indel)} nodes found in rst "
-            f"but missing from indel file (skipped). "
-            f"Examples: {missing_indel[:5]}"
-        )
-
-    extra_indel_nodes = set(indel_dict.keys()) - set(state_dict.keys())
-    if extra_indel_nodes:
-        print(
-            f"[WARN] {len(extra_indel_nodes)} nodes found in indel file "
-            f"but not in rst (ignored). "
-            f"Examples: {sorted(list(extra_indel_nodes))[:5]}"
+    if bit_arr.size != len(seq):
+        raise ValueError(
+            f"[ERROR] Length mismatch for node {node.decode()}: "
+            f"state={len(seq)} indel={bit_arr.size}"
         )
 
-    return merged
+    # Branchless byte select, all in place on two scratch arrays:
+    # keep = 0xFF for '1' columns and 0x00 for '0' columns, then
+    # merged = (AA & keep) | ('-' & ~keep). '0' columns become '-', all
+    # other columns keep the AA (an existing '-' stays '-'). The cost
+    # does not depend on how the deletions are distributed.
+    keep = bit_arr - BIT_DELETED          # 1 / 0
+    np.negative(keep, out=keep)           # 0xFF / 0x00
+    merged = np.frombuffer(seq, dtype=np.uint8) & keep
+    np.invert(keep, out=keep)
+    keep &= GAP
+    merged |= keep
+    return merged.tobytes()
 
 
 # ---------------------------
 # FASTA writer
 # ---------------------------
 
-def write_fasta(seqs, outpath, remove_gaps=False):
+class FastaPairWriter:
     """
-    Write a dict of sequences {name: seq} to a FASTA file.
-
-    If remove_gaps=True, all '-' characters are stripped from each sequence
-    before writing (matching the IQ-TREE version behavior).
+    Write records to a with-gap FASTA file and, with all '-' characters
+    stripped, to a gap-stripped FASTA file (matching the IQ-TREE version
+    behavior) as they arrive.
+
+    Either path may be None to skip that output. Each header is built
+    once and shared by both files. Records are collected and
+    written with one writelines() call every `flush_every` records,
+    into files opened with a `buffer_size` (default 1 MiB) buffer, so
+    runs of short records reach the OS as large writes.
+
+    Records go to "<path>.tmp" files that are moved onto the output
+    paths only by close(). Use as a context manager: if the block raises,
+    the temporary files are removed and existing outputs are left as
+    they were, so a failed run never leaves truncated FASTA behind.
     """
-    with open(outpath, "w", encoding="utf-8") as f:
-        for name, seq in seqs.items():
-            out_seq = seq.replace("-", "") if remove_gaps else seq
-            f.write(f">{name}\n")
-            # For now, write the sequence as a single line (no wrapping).
-            f.write(out_seq + "\n")
+
+    def __init__(self, path_withgap, path_nogap, flush_every=1000,
+                 buffer_size=1 << 20):
+        self.flush_every = flush_every
+        self.n = 0
+        self.outputs = []  # (path, temporary path, file, pending chunks, strip gaps?)
+        try:
+            for path, strip_gaps in ((path_withgap, False), (path_nogap, True)):
+                if path:
+                    tmp_path = f"{path}.tmp"
+                    f = open(tmp_path, "wb", buffering=buffer_size)
+                    self.outputs.append((path, tmp_path, f, [], strip_gaps))
+        except BaseException:
+            # Do not leak the file that was already opened
+            self.discard()
+            raise
+
+    def write(self, name, seq):
+        """Add one record; name and seq are bytes."""
+        header = b">" + name + b"\n"
+        # For now, write the sequence as a single line (no wrapping).
+        for _, _, _, chunks, strip_gaps in self.outputs:
+            out_seq = seq.translate(None, GAP_BYTES) if strip_gaps else seq
+            chunks.append(header + out_seq + b"\n")
+        self.n += 1
+        if self.n % self.flush_every == 0:
+            self.flush()
+
+    def flush(self):
+        for _, _, f, chunks, _ in self.outputs:
+            f.writelines(chunks)
+            chunks.clear()
+
+    def close(self):
+        """Write out pending records and move the files into place."""
+        try:
+            self.flush()
+            for _, _, f, _, _ in self.outputs:
+                f.close()
+        except BaseException:
+            self.discard()
+            raise
+        for path, tmp_path, _, _, _ in self.outputs:
+            os.replace(tmp_path, path)
+
+    def discard(self):
+        """Close and remove the temporary files without touching the outputs."""
+        for _, tmp_path, f, _, _ in self.outputs:
+            try:
+                f.close()
+            except OSError:
+                pass
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
 
 
 # ---------------------------
@@ -240,34 +350,85 @@ def main():
                         help="Output FASTA (alignment-like, with gaps)")
     parser.add_argument("--out_nogap", default="ASR_PAML_indel_nogap.fasta",
                         help="Output FASTA (gap-stripped, e.g., for AlphaFold input)")
+    parser.add_argument("--skip_withgap", action="store_true",
+                        help="Do not write the --out_withgap FASTA")
+    parser.add_argument("--skip_nogap", action="store_true",
+                        help="Do not write the --out_nogap FASTA")
     args = parser.parse_args()
 
-    print(f"[INFO] Reading PAML rst: {args.rst}")
-    state_dict = parse_all_nodes_from_rst(args.rst)
-    print(f"[INFO] Loaded {len(state_dict)} nodes from rst")
+    # None disables that output of the pair writer
+    out_withgap = None if args.skip_withgap else args.out_withgap
+    out_nogap = None if args.skip_nogap else args.out_nogap
 
+    # The indel patterns (one byte per column) are loaded up front; the
+    # rst nodes are then parsed, merged and written one at a time, so no
+    # more than one ancestral sequence is held in memory.
     print(f"[INFO] Reading indel file: {args.indel}")
     indel_dict = parse_indel_file(args.indel)
     print(f"[INFO] Loaded {len(indel_dict)} indel profiles")
 
-    print("[INFO] Merging AA states and indel patterns...")
-    merged = merge_state_and_indel(state_dict, indel_dict)
-    print(f"[INFO] Merged {len(merged)} sequences")
+    print(f"[INFO] Reading PAML rst and merging AA states and indel patterns: {args.rst}")
+    seen = set()          # node IDs read from rst
+    duplicated = []       # node IDs with more than one rst block
+    missing_indel = []    # rst nodes without an indel pattern
+    lengths = set()       # sequence lengths, for the consistency check
+    n_merged = 0
+
+    with FastaPairWriter(args.out_raw_withgap, args.out_raw_nogap) as raw_out, \
+            FastaPairWriter(out_withgap, out_nogap) as merged_out:
+        for node, seq in iter_nodes_from_rst(args.rst):
+            if node in seen:
+                duplicated.append(node)
+            seen.add(node)
+            lengths.add(len(seq))
+            raw_out.write(node, seq)
+
+            bit_arr = indel_dict.get(node)
+            if bit_arr is None:
+                missing_indel.append(node)
+                continue
+            merged_out.write(node, merge_one(node, seq, bit_arr))
+            n_merged += 1
+
+        # Raised inside the block so that no empty outputs are kept
+        if not seen:
+            raise ValueError(f"No node sequences found in {args.rst}")
+
+    print(f"[INFO] Loaded {len(seen)} nodes from rst")
+    if duplicated:
+        print(
+            f"[WARN] {len(duplicated)} node IDs appear in more than one rst "
+            f"block (each block written as its own record). "
+            f"Examples: {[n.decode() for n in duplicated[:5]]}"
+        )
+
+    # Optional: length consistency check
+    if len(lengths) != 1:
+        print(f"[WARN] PAML rst sequences have multiple lengths: {lengths}")
 
-    if args.out_raw_withgap:
-        write_fasta(state_dict, args.out_raw_withgap, remove_gaps=False)
+    if missing_indel:
+        print(
+            f"[WARN] {len(missing_indel)} nodes found in rst "
+            f"but missing from indel file (skipped). "
+            f"Examples: {[n.decode() for n in missing_indel[:5]]}"
+        )
 
-    if args.out_raw_nogap:
-        write_fasta(state_dict, args.out_raw_nogap, remove_gaps=True)
+    # Dict-view difference: no intermediate set of the indel keys
+    extra_indel_nodes = indel_dict.keys() - seen
+    if extra_indel_nodes:
+        print(
+            f"[WARN] {len(extra_indel_nodes)} nodes found in indel file "
+            f"but not in rst (ignored). "
+            f"Examples: {[n.decode() for n in sorted(extra_indel_nodes)[:5]]}"
+        )
 
-    write_fasta(merged, args.out_withgap, remove_gaps=False)
-    write_fasta(merged, args.out_nogap, remove_gaps=True)
+    print(f"[INFO] Merged {n_merged} sequences")
 
     print("[DONE] Output written:")
     print(f"           raw with gaps : {args.out_raw_withgap}")
     print(f"           raw no gaps   : {args.out_raw_nogap}")
-    print(f"           with gaps : {args.out_withgap}")
-    print(f"           no gaps   : {args.out_nogap}")
+    print(f"           with gaps : {out_withgap or '(skipped)'}")
+    print(f"           no gaps   : {out_nogap or '(skipped)'}")
 
 
 if __name__ == "__main__":